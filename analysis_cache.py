@@ -0,0 +1,49 @@
+﻿"""Page Analysis Cache: SQLite-backed store of per-page structure and entity scans keyed by content hash"""
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+import orjson
+
+_LOOKUP_BATCH = 500  # Keys per SELECT, below SQLite's bound-parameter limit
+
+class AnalysisCache:
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS analyses (key TEXT PRIMARY KEY, analysis BLOB NOT NULL)'
+            )
+            self._conn.commit()
+    
+    @staticmethod
+    def make_key(content: str) -> str:
+        """Hash of the page text the scans ran over"""
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[Dict, Tuple]]:
+        """Cached (structure, entities) for the keys that hit"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[start:start + _LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, analysis FROM analyses WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, analysis in rows:
+                    structure, entities = orjson.loads(analysis)
+                    found[key] = (structure, tuple(map(tuple, entities)))  # JSON arrays back to tuples
+        return found
+    
+    def put_many(self, analyses: Dict[str, Tuple[Dict, Tuple]]):
+        """Store freshly computed (structure, entities) pairs"""
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO analyses (key, analysis) VALUES (?, ?)',
+                ((key, orjson.dumps(analysis)) for key, analysis in analyses.items())
+            )
+            self._conn.commit()
@@ -5,37 +5,164 @@ import logging
 from pathlib import Path
 from datetime import datetime
 import re
+import orjson
 import requests
 import subprocess
+import threading
+import traceback
+from collections import deque
+from urllib3.exceptions import ReadTimeoutError
+from agents.chat_memory import ChatMemory
+from agents.ensemble_judge_agent import EnsembleJudgeAgent
+from agents.fact_checking_agent import FactCheckingAgent
+from agents.ingestion_agent import IngestionAgent
+from agents.judge_agent import JudgeAgent
+from agents.ollama_http import create_session
+from agents.parameter_extraction_agent import ParameterExtractionAgent, TRAJECTORY_COLUMNS
+from agents.preprocessing_agent import PreprocessingAgent
+from agents.rag_retrieval_agent import RAGRetrievalAgent
+
+try:
+    from yaml import CSafeLoader as _YamlLoader  # libyaml C parser
+except ImportError:
+    _YamlLoader = yaml.SafeLoader
 
 # Load v5.0 config
-config = yaml.safe_load(open('config/config_v5.yaml'))
+with open('config/config_v5.yaml') as f:
+    config = yaml.load(f, Loader=_YamlLoader)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%H:%M:%S')
 
+# Keep-alive connection pool for the chat model, shared by every Gradio worker thread
+SESSION = create_session()
+
+# System prompts stay byte-identical across queries so the server can reuse their KV cache;
+# everything per-query (memory, documents, question) goes into the user turns after them
+SUMMARY_SYSTEM = """Technical writer for geothermal well reports. Create structured summary (max 300 words).
+
+CITATION RULES:
+- Use exact document name + page
+- Format: "2680 m (NLOG_GS_PUB_End-of-well-report-NAALDWIJK-GT-02-S1, p.7)"
+- Cite after EVERY fact
+
+Structure:
+1. Well Name & Location
+2. Depths (MD/TVD) with citations
+3. Drilling Dates with citations
+4. Key Formations
+5. Completion Status
+
+SI units only.
+"""
+
+QA_SYSTEM = """Technical analyst. Answer with INLINE citations using exact document names.
+
+RULES:
+- Format: "2694 m (NLOG_GS_PUB_110211-EWOR-HAG-GT-01, p.8)"
+- Cite after EVERY number/date
+- SI units only
+- Be precise
+
+"""
+
+def _iter_stream(resp):
+    """resp.iter_lines(), but a stream that stalls past the timeout raises requests.Timeout
+    (requests wraps mid-body read timeouts in ConnectionError)"""
+    try:
+        yield from resp.iter_lines()
+    except requests.ConnectionError as e:
+        if e.args and isinstance(e.args[0], ReadTimeoutError):
+            raise requests.ReadTimeout(e) from e
+        raise
+
+# Prompt budget per retrieved chunk, in approximate model tokens
+SUMMARY_CHUNK_TOKENS = 90
+QA_CHUNK_TOKENS = 160
+
+# Approximate Qwen token units: Qwen encodes every digit as its own token,
+# ordinary words and punctuation marks mostly as one
+_TOKEN_RE = re.compile(r'\d|[^\W\d]+|[^\w\s]')
+
+def _truncate_tokens(text, max_tokens):
+    """Text up to its max_tokens-th approximate token - number-heavy tables are cut sooner than prose"""
+    for count, match in enumerate(_TOKEN_RE.finditer(text), 1):
+        if count == max_tokens:
+            return text[:match.end()]
+    return text
+
+def _unique_chunks(chunks, k):
+    """First k chunks whose opening text hasn't been seen yet - overlapping windows and
+    boilerplate repeated across reports only cost prompt tokens once"""
+    seen = set()
+    unique = []
+    for c in chunks:
+        key = c['content'][:200]
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(c)
+        if len(unique) == k:
+            break
+    return unique
+
+def _display_label(metadata):
+    """"[doc, p.N]" source label - precomputed at chunking time, rebuilt for chunks indexed before that"""
+    label = metadata.get('display_label')
+    if label is None:
+        label = f"[{Path(metadata.get('source_file', 'Unknown')).stem}, p.{metadata.get('page_number', '?')}]"
+    return label
+
+def _chatml(messages, answer_prefix=""):
+    """Render chat messages as a raw Qwen ChatML prompt, opening the assistant turn"""
+    turns = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+    return f"{turns}<|im_start|>assistant\n{answer_prefix}"
+
 class LogCapture:
-    def __init__(self):
-        self.logs = []
+    def __init__(self, max_lines=50):
+        self.logs = deque(maxlen=max_lines)  # Only the lines the UI shows are kept
+        self._tail = ""  # self.logs joined by newlines, kept in step with every append
+        self._lock = threading.Lock()  # Gradio events and streaming workers log concurrently
+    
+    @property
+    def tail(self):
+        """Log text for the UI"""
+        return self._tail
+    
+    def _append(self, log_entry):
+        """Append one line; caller holds self._lock so self.logs and self._tail change together"""
+        if len(self.logs) == self.logs.maxlen:
+            self._tail = self._tail[len(self.logs[0]) + 1:]  # Drop the evicted line and its newline
+        self._tail = f"{self._tail}\n{log_entry}" if self._tail else log_entry
+        self.logs.append(log_entry)
     
     def add(self, message, level="INFO"):
         timestamp = datetime.now().strftime("%H:%M:%S")
         log_entry = f"[{timestamp}] [{level}] {message}"
-        self.logs.append(log_entry)
+        with self._lock:
+            self._append(log_entry)
+            tail = self._tail
         logging.info(message)
-        return "\n".join(self.logs[-50:])
+        return tail
+    
+    def add_many(self, entries):
+        """Add (message, level) entries in one go - one timestamp"""
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        with self._lock:
+            for message, level in entries:
+                self._append(f"[{timestamp}] [{level}] {message}")
+                logging.info(message)
+            tail = self._tail
+        return tail
 
 log_capture = LogCapture()
 
 class DocumentStore:
     def __init__(self):
-        from agents.chat_memory import ChatMemory
-        from agents.ensemble_judge_agent import EnsembleJudgeAgent
-        from agents.fact_checking_agent import FactCheckingAgent
-        
-        self.rag_agent = None
         self.documents = []
         self.indexed_files = set()
         self.wells = set()
+        self._well_matcher = None  # All known wells in one case-insensitive regex
+        self._wells_by_upper = {}
         self.log_capture = log_capture
         self.memory = ChatMemory(config)
         
@@ -44,20 +171,42 @@ class DocumentStore:
             self.judge = EnsembleJudgeAgent(config)
             self.log_capture.add("🎯 Ensemble Judge enabled", "INFO")
         else:
-            from agents.judge_agent import JudgeAgent
             self.judge = JudgeAgent(config)
             self.log_capture.add("⚖️  Single Judge mode", "INFO")
         
         self.fact_checker = FactCheckingAgent(config)
+        self.extractor = ParameterExtractionAgent(config)  # One session, model preloaded once
         self.last_trajectory = None
+        
+        self.rag_agent = RAGRetrievalAgent(config)
+        self.log_capture.add("🔧 RAGRetrievalAgent: Hybrid mode initialized", "INFO")
+        self._restore_indexed_documents()
+    
+    def _restore_indexed_documents(self):
+        """Pick up the files an earlier run indexed, from the chunks the retrieval agent reloaded"""
+        restored = {}
+        for chunks in self.rag_agent.documents_cache.values():
+            for chunk in chunks:
+                meta = chunk['metadata']
+                restored.setdefault(meta.get('source_file', 'Unknown'), meta.get('well_names', ''))
+        if not restored:
+            return
+        
+        for source_file, well_names in restored.items():
+            wells = [w.strip() for w in well_names.split(',') if w.strip()]
+            self.documents.append({
+                'source_file': source_file,
+                'wells': wells,
+                'metadata': {'source_file': source_file, 'well_names': well_names}
+            })
+            self.indexed_files.add(source_file)
+            self.wells.update(wells)
+        self._build_well_matcher()
+        self.log_capture.add(f"♻️  Restored {len(restored)} indexed files. Wells: {', '.join(sorted(self.wells))}", "INFO")
 
     def index_documents(self, files):
-        from agents.ingestion_agent import IngestionAgent
-        from agents.preprocessing_agent import PreprocessingAgent
-        from agents.rag_retrieval_agent import RAGRetrievalAgent
-
         if not files:
-            return "No files selected.", "\n".join(self.log_capture.logs[-50:])
+            return "No files selected.", self.log_capture.tail
         
         self.log_capture.add(f"📤 Starting upload of {len(files)} files", "INFO")
         file_paths = [f.name for f in files]
@@ -66,7 +215,7 @@ class DocumentStore:
         if not new_files:
             msg = f"Already indexed. Wells: {', '.join(self.wells)}"
             self.log_capture.add("⚠️  All files already indexed", "WARN")
-            return msg, "\n".join(self.log_capture.logs[-50:])
+            return msg, self.log_capture.tail
 
         try:
             self.log_capture.add(f"📄 Processing {len(new_files)} new files", "INFO")
@@ -79,37 +228,39 @@ class DocumentStore:
             prep = PreprocessingAgent(config)
             all_chunks = prep.process_all_strategies(docs['documents'], self.log_capture)
             
-            if self.rag_agent is None:
-                self.rag_agent = RAGRetrievalAgent(config)
-                self.log_capture.add("🔧 RAGRetrievalAgent: Hybrid mode initialized", "INFO")
-            
-            total = 0
-            for strategy, chunks in all_chunks.items():
-                self.log_capture.add(f"💾 Indexing {len(chunks)} chunks for {strategy}", "INFO")
-                self.rag_agent.index_documents(chunks, strategy=strategy)
-                total += len(chunks)
+            # All strategies in one batched embedding pass
+            self.log_capture.add_many([(f"💾 Indexing {len(chunks)} chunks for {strategy}", "INFO")
+                                       for strategy, chunks in all_chunks.items()])
+            self.rag_agent.index_documents_batched(all_chunks)
+            total = sum(len(chunks) for chunks in all_chunks.values())
             
             self.documents.extend(docs['documents'])
             self.indexed_files.update([Path(f).name for f in new_files])
             
-            for d in docs['documents']:
-                wells = d['metadata'].get('well_names', '')
-                if isinstance(wells, str):
-                    self.wells.update(w.strip() for w in wells.split(',') if w.strip())
+            self.wells.update(w for d in docs['documents'] for w in d['wells'])
+            self._build_well_matcher()
             
             result = f"✅ Indexed {len(new_files)} files ({total} chunks)\n\n📊 Wells: {', '.join(sorted(self.wells))}"
             self.log_capture.add(f"✅ Indexing complete: {total} chunks.", "SUCCESS")
-            return result, "\n".join(self.log_capture.logs[-50:])
+            return result, self.log_capture.tail
 
         except Exception as e:
-            import traceback
             err = f"Error: {e}\n{traceback.format_exc()[:400]}"
             self.log_capture.add(f"❌ ERROR: {str(e)[:200]}", "ERROR")
-            return err, "\n".join(self.log_capture.logs[-50:])
+            return err, self.log_capture.tail
 
+    def _build_well_matcher(self):
+        """One scan finds any known well in a query; longest names first so NLW-GT-02-S1 beats NLW-GT-02"""
+        self._wells_by_upper = {w.upper(): w for w in self.wells}
+        if self._wells_by_upper:
+            names = sorted(self._wells_by_upper, key=len, reverse=True)
+            self._well_matcher = re.compile('|'.join(map(re.escape, names)), re.IGNORECASE)
+    
     def query(self, user_query):
+        """Answer a query, yielding (answer, logs, nodal button) as the answer streams in"""
         if not self.documents:
-            return "Please upload documents first.", "\n".join(self.log_capture.logs[-50:]), gr.update(visible=False)
+            yield "Please upload documents first.", self.log_capture.tail, gr.update(visible=False)
+            return
         
         try:
             self.log_capture.add(f"🔍 Query: {user_query[:100]}", "INFO")
@@ -127,7 +278,8 @@ class DocumentStore:
             self.log_capture.add(f"🎯 Mode: {mode.upper()}", "INFO")
             
             # Well-specific filtering
-            target_well = next((w for w in self.wells if w.upper() in user_query.upper()), None)
+            match = self._well_matcher.search(user_query) if self._well_matcher else None
+            target_well = self._wells_by_upper[match.group().upper()] if match else None
             if target_well:
                 self.log_capture.add(f"🎯 Target: {target_well}", "INFO")
             
@@ -138,27 +290,26 @@ class DocumentStore:
             # Mode-specific processing
             if mode == "extract":
                 # Enhanced trajectory extraction
-                from agents.parameter_extraction_agent import ParameterExtractionAgent
-                ext = ParameterExtractionAgent(config)
                 self.log_capture.add("🔧 Enhanced trajectory extraction...", "INFO")
-                traj = ext.extract(retrieved['chunks'], self.log_capture)
+                traj = self.extractor.extract(retrieved['chunks'], self.log_capture)
                 
-                if traj['trajectory'] and len(traj['trajectory']) > 0:
-                    self.last_trajectory = traj['trajectory']
-                    answer = f"**Trajectory Extracted:** {len(traj['trajectory'])} points\n\n"
+                trajectory = traj['trajectory_array']
+                if len(trajectory) > 0:
+                    self.last_trajectory = trajectory
+                    answer = f"**Trajectory Extracted:** {len(trajectory)} points\n\n"
                     answer += f"**Confidence:** {traj.get('confidence', 0):.0%}\n"
                     answer += f"**Sources:** {traj.get('source_chunks', 0)} chunks analyzed\n\n"
                     answer += "| MD (m) | TVD (m) | ID (m) |\n|--------|---------|--------|\n"
                     
                     # Show first 20 points
-                    for p in traj['trajectory'][:20]:
-                        answer += f"| {p['MD']:.1f} | {p['TVD']:.1f} | {p.get('ID', 0.216):.3f} |\n"
+                    for md, tvd, id_ in trajectory[:20].tolist():
+                        answer += f"| {md:.1f} | {tvd:.1f} | {id_:.3f} |\n"
                     
-                    if len(traj['trajectory']) > 20:
-                        answer += f"\n*Showing 20 of {len(traj['trajectory'])} points*"
+                    if len(trajectory) > 20:
+                        answer += f"\n*Showing 20 of {len(trajectory)} points*"
                     
                     nodal_btn_state = gr.update(visible=True)
-                    self.log_capture.add(f"✅ Extracted {len(traj['trajectory'])} points", "SUCCESS")
+                    self.log_capture.add(f"✅ Extracted {len(trajectory)} points", "SUCCESS")
                 else:
                     answer = "⚠️ No trajectory found in retrieved chunks.\n\n"
                     answer += "Try:\n• More specific query: 'Extract trajectory table from HAG-GT-01'\n"
@@ -168,82 +319,38 @@ class DocumentStore:
             
             elif mode == 'summary':
                 # Optimized summary mode - more chunks, better context
-                context_parts = []
-                for i, c in enumerate(retrieved['chunks'][:15]):  # Increased from 10 to 15
-                    doc_name = Path(c['metadata'].get('source_file', 'Unknown')).stem
-                    page = c['metadata'].get('page_number', '?')
-                    
-                    context_parts.append(
-                        f"[{doc_name}, p.{page}]\n{c['content'][:400]}"  # More context per chunk
-                    )
-                
-                context = '\n\n'.join(context_parts)
+                context = '\n\n'.join(
+                    f"{_display_label(c['metadata'])}\n{_truncate_tokens(c['content'], SUMMARY_CHUNK_TOKENS)}"
+                    for c in _unique_chunks(retrieved['chunks'], 15)  # Increased from 10 to 15
+                )
                 
-                prompt = f"""<|im_start|>system
-Technical writer for geothermal well reports. Create structured summary (max 300 words).
-
-CITATION RULES:
-- Use exact document name + page
-- Format: "2680 m (NLOG_GS_PUB_End-of-well-report-NAALDWIJK-GT-02-S1, p.7)"
-- Cite after EVERY fact
-
-Structure:
-1. Well Name & Location
-2. Depths (MD/TVD) with citations
-3. Drilling Dates with citations
-4. Key Formations
-5. Completion Status
-
-SI units only.
-<|im_end|>
-<|im_start|>user
-{f"Context: {memory_context[:300]}" if memory_context else ""}
-
-Question: {user_query}
+                system = SUMMARY_SYSTEM
+                memory_turn = f"Context: {memory_context}" if memory_context else ""
+                user = f"""Question: {user_query}
 
 Documents (15 chunks):
 {context}
-<|im_end|>
-<|im_start|>assistant
-**Well Summary:**
 """
+                answer_prefix = "**Well Summary:**\n"
                 
                 timeout = 900
                 max_tokens = 450  # Slightly increased for better summaries
             
             else:
                 # Factual Q&A mode
-                context_parts = []
-                for i, c in enumerate(retrieved['chunks'][:10]):
-                    doc_name = Path(c['metadata'].get('source_file', 'Unknown')).stem
-                    page = c['metadata'].get('page_number', '?')
-                    
-                    context_parts.append(
-                        f"[{doc_name}, p.{page}]\n{c['content'][:700]}"
-                    )
+                context = '\n\n'.join(
+                    f"{_display_label(c['metadata'])}\n{_truncate_tokens(c['content'], QA_CHUNK_TOKENS)}"
+                    for c in _unique_chunks(retrieved['chunks'], 10)
+                )
                 
-                context = '\n\n'.join(context_parts)
-                
-                prompt = f"""<|im_start|>system
-Technical analyst. Answer with INLINE citations using exact document names.
-
-RULES:
-- Format: "2694 m (NLOG_GS_PUB_110211-EWOR-HAG-GT-01, p.8)"
-- Cite after EVERY number/date
-- SI units only
-- Be precise
-
-<|im_end|>
-<|im_start|>user
-{f"Previous: {memory_context[:300]}" if memory_context else ""}
-
-Question: {user_query}
+                system = QA_SYSTEM
+                memory_turn = f"Previous: {memory_context}" if memory_context else ""
+                user = f"""Question: {user_query}
 
 Documents:
 {context}
-<|im_end|>
-<|im_start|>assistant
 """
+                answer_prefix = ""
                 
                 timeout = 300
                 max_tokens = 300
@@ -253,28 +360,28 @@ Documents:
                 max_retries = 2
                 answer = None
                 
+                # Static system prompt first, conversation memory as its own leading user turn
+                messages = [{'role': 'system', 'content': system}]
+                if memory_turn:
+                    messages.append({'role': 'user', 'content': memory_turn})
+                messages.append({'role': 'user', 'content': user})
+                
+                backend = config.get('chat', {}).get('backend', 'ollama')
+                if backend == 'openai':
+                    chat_model = config['chat']['model']
+                    timeout = config['chat'].get('timeout', 120)
+                else:
+                    chat_model = config['ollama']['model_chat']
+                
                 for attempt in range(max_retries):
                     try:
-                        self.log_capture.add(f"🤖 Qwen2.5:7b (attempt {attempt+1}/{max_retries})", "INFO")
-                        
-                        resp = requests.post(
-                            f"{config['ollama']['host']}/api/generate",
-                            json={
-                                'model': config['ollama']['model_chat'],
-                                'prompt': prompt,
-                                'stream': False,
-                                'options': {
-                                    'temperature': 0.15,
-                                    'num_ctx': 6144 if mode == 'summary' else 8192,
-                                    'top_p': 0.9,
-                                    'repeat_penalty': 1.1,
-                                    'num_predict': max_tokens
-                                }
-                            },
-                            timeout=timeout
-                        )
+                        log_text = self.log_capture.add(f"🤖 {chat_model} (attempt {attempt+1}/{max_retries})", "INFO")
                         
-                        answer = resp.json().get('response', 'No response').strip()
+                        # Show the answer as it is decoded; validation runs once it is complete
+                        answer = ""
+                        for answer in self._generate(backend, messages, answer_prefix, mode, max_tokens, timeout):
+                            yield answer, log_text, gr.update(visible=False)
+                        answer = answer.strip()
                         self.log_capture.add("✅ Answer generated", "SUCCESS")
                         break
                     
@@ -285,14 +392,16 @@ Documents:
                             continue
                         else:
                             self.log_capture.add("❌ Final timeout", "ERROR")
-                            return "⚠️ Timed out. Try simpler query or specify well name.", \
-                                   "\n".join(self.log_capture.logs[-50:]), gr.update(visible=False)
+                            yield "⚠️ Timed out. Try simpler query or specify well name.", \
+                                  self.log_capture.tail, gr.update(visible=False)
+                            return
                 
                 if not answer:
-                    return "⚠️ No answer generated", "\n".join(self.log_capture.logs[-50:]), gr.update(visible=False)
+                    yield "⚠️ No answer generated", self.log_capture.tail, gr.update(visible=False)
+                    return
                 
                 # Ensemble Judge Validation
-                self.log_capture.add("⚖️  Ensemble validation...", "INFO")
+                yield answer, self.log_capture.add("⚖️  Ensemble validation...", "INFO"), gr.update(visible=False)
                 validation = self.judge.validate(answer, retrieved['chunks'], user_query)
                 
                 # Format validation results
@@ -317,27 +426,120 @@ Documents:
             self.memory.add_turn(user_query, answer, {'well_name': target_well, 'mode': mode})
             self.log_capture.add("✅ Complete", "SUCCESS")
             
-            return answer, "\n".join(self.log_capture.logs[-50:]), nodal_btn_state
+            yield answer, self.log_capture.tail, nodal_btn_state
 
         except Exception as e:
-            import traceback
             self.log_capture.add(f"❌ ERROR: {str(e)[:200]}", "ERROR")
-            return f"Error: {str(e)}\n{traceback.format_exc()[:300]}", \
-                   "\n".join(self.log_capture.logs[-50:]), gr.update(visible=False)
+            yield f"Error: {str(e)}\n{traceback.format_exc()[:300]}", \
+                  self.log_capture.tail, gr.update(visible=False)
+    
+    def _generate(self, backend, messages, answer_prefix, mode, max_tokens, timeout):
+        """Stream a chat completion from Ollama or an OpenAI-compatible server (e.g. vLLM),
+        yielding the answer so far (answer_prefix included) after every received piece"""
+        answer = answer_prefix
+        if backend == 'openai':
+            # Structured messages so the server applies the model's own chat template; the
+            # answer prefix is sent as the opening of the assistant turn for the model to continue
+            prefill = {
+                'messages': messages + [{'role': 'assistant', 'content': answer_prefix}],
+                'add_generation_prompt': False,  # vLLM extensions of the OpenAI schema
+                'continue_final_message': True
+            } if answer_prefix else {'messages': messages}
+            with SESSION.post(
+                f"{config['chat']['base_url']}/chat/completions",
+                headers={'Authorization': f"Bearer {config['chat'].get('api_key', 'EMPTY')}"},
+                json={
+                    'model': config['chat']['model'],
+                    **prefill,
+                    'temperature': 0.15,
+                    'top_p': 0.9,
+                    'repetition_penalty': 1.1,  # vLLM extension of the OpenAI schema
+                    'max_tokens': max_tokens,
+                    'stream': True
+                },
+                timeout=timeout,
+                stream=True
+            ) as resp:
+                resp.raise_for_status()  # An error body is not an empty answer
+                # Server-sent events: "data: {json}" lines, terminated by "data: [DONE]"
+                for line in _iter_stream(resp):
+                    if not line.startswith(b'data: ') or line == b'data: [DONE]':
+                        continue
+                    piece = orjson.loads(line[6:])['choices'][0]['delta'].get('content')
+                    if piece:
+                        answer += piece
+                        yield answer
+            return
+        
+        with SESSION.post(
+            f"{config['ollama']['host']}/api/generate",
+            json={
+                'model': config['ollama']['model_chat'],
+                'prompt': _chatml(messages, answer_prefix),
+                'stream': True,
+                'keep_alive': config['ollama'].get('keep_alive', '30m'),
+                'options': {
+                    'temperature': 0.15,
+                    'num_ctx': 6144 if mode == 'summary' else 8192,
+                    'top_p': 0.9,
+                    'repeat_penalty': 1.1,
+                    'num_predict': max_tokens
+                }
+            },
+            timeout=timeout,
+            stream=True
+        ) as resp:
+            resp.raise_for_status()
+            # NDJSON: one {"response": "<piece>", "done": false} object per line
+            for line in _iter_stream(resp):
+                if not line:
+                    continue
+                piece = orjson.loads(line).get('response')
+                if piece:
+                    answer += piece
+                    yield answer
+    
+    def warmup(self):
+        """Load the chat model and the embedder before the first user request needs them"""
+        try:
+            if config.get('chat', {}).get('backend', 'ollama') == 'openai':
+                SESSION.post(
+                    f"{config['chat']['base_url']}/chat/completions",
+                    headers={'Authorization': f"Bearer {config['chat'].get('api_key', 'EMPTY')}"},
+                    json={'model': config['chat']['model'], 'messages': [{'role': 'user', 'content': 'hi'}],
+                          'max_tokens': 1},
+                    timeout=300
+                )
+            else:
+                # A generate request without a prompt only loads the model
+                SESSION.post(
+                    f"{config['ollama']['host']}/api/generate",
+                    json={'model': config['ollama']['model_chat'],
+                          'keep_alive': config['ollama'].get('keep_alive', '30m')},
+                    timeout=300
+                )
+        except requests.RequestException as e:
+            self.log_capture.add(f"⚠️  Chat model warm-up failed: {str(e)[:100]}", "WARN")
+        
+        try:
+            self.rag_agent.embedding_function(["warmup"])  # First call loads the embedding model
+        except Exception as e:
+            self.log_capture.add(f"⚠️  Embedding model warm-up failed: {str(e)[:100]}", "WARN")
     
     def run_nodal_analysis(self):
         """Execute nodal analysis with extracted trajectory"""
-        if not self.last_trajectory:
+        if self.last_trajectory is None or not len(self.last_trajectory):
             return "No trajectory data. Extract trajectory first."
         
         try:
             self.log_capture.add("🔧 Running Nodal Analysis...", "INFO")
             
-            import json
+            # Separate process: its output is captured on its own, and a hung run is killed at the timeout
             trajectory_file = 'temp_trajectory.json'
             
-            with open(trajectory_file, 'w') as f:
-                json.dump(self.last_trajectory, f, indent=2)
+            # The nodal script reads a list of {MD, TVD, ID} points
+            points = [dict(zip(TRAJECTORY_COLUMNS, row)) for row in self.last_trajectory.tolist()]
+            Path(trajectory_file).write_bytes(orjson.dumps(points))
             
             self.log_capture.add(f"💾 Saved {len(self.last_trajectory)} points", "INFO")
             
@@ -364,99 +566,99 @@ Documents:
         except Exception as e:
             return f"⚠️ Error: {str(e)}"
 
-# Initialize document store
-store = DocumentStore()
-
-# Gradio UI
-with gr.Blocks(title="Geothermal RAG v5.0", theme=gr.themes.Soft()) as app:
-    gr.Markdown("# 🌋 Geothermal RAG v5.0 - Ensemble Judge + Enhanced Trajectory")
-    gr.Markdown("*Ultra-sophisticated chunking • Ensemble validation • Exact citations • Trajectory extraction*")
-    
-    with gr.Row():
-        with gr.Column(scale=1):
-            gr.Markdown("### 📤 Upload Documents")
-            files = gr.File(
-                label="Select PDF Files", 
-                file_count="multiple", 
-                file_types=[".pdf"]
-            )
-            upload_btn = gr.Button("📥 Index Files (60-120 sec)", variant="primary", size="lg")
-            status = gr.Textbox(label="Upload Status", lines=4, interactive=False)
-            
-            gr.Markdown("### 📊 System Activity")
-            log_box = gr.Textbox(label="Agent Logs", lines=10, interactive=False, show_copy_button=True)
-            
-            gr.Markdown("### 💡 Example Queries")
-            gr.Markdown("""
+def build_ui(store):
+    """Gradio UI wired to a document store"""
+    with gr.Blocks(title="Geothermal RAG v5.0", theme=gr.themes.Soft()) as app:
+        gr.Markdown("# 🌋 Geothermal RAG v5.0 - Ensemble Judge + Enhanced Trajectory")
+        gr.Markdown("*Ultra-sophisticated chunking • Ensemble validation • Exact citations • Trajectory extraction*")
+        
+        with gr.Row():
+            with gr.Column(scale=1):
+                gr.Markdown("### 📤 Upload Documents")
+                files = gr.File(
+                    label="Select PDF Files", 
+                    file_count="multiple", 
+                    file_types=[".pdf"]
+                )
+                upload_btn = gr.Button("📥 Index Files (60-120 sec)", variant="primary", size="lg")
+                status = gr.Textbox(label="Upload Status", lines=4, interactive=False)
+                
+                gr.Markdown("### 📊 System Activity")
+                log_box = gr.Textbox(label="Agent Logs", lines=10, interactive=False, show_copy_button=True)
+                
+                gr.Markdown("### 💡 Example Queries")
+                gr.Markdown("""
 - **Factual:** What is total depth of HAG-GT-01?
 - **Summary:** Give a summary of NLW-GT-02-S1
 - **Trajectory:** Extract trajectory of HAG-GT-01
 - **Multi-turn:** What about the previous well?
-            """)
-        
-        with gr.Column(scale=2):
-            gr.Markdown("### 💬 Ask Your Question")
-            query_text = gr.Textbox(
-                label="Query", 
-                lines=2, 
-                placeholder="e.g., What is total depth of HAG-GT-01?"
-            )
+                """)
             
-            with gr.Row():
-                query_btn = gr.Button("🚀 Ask", variant="primary", size="lg")
-                clear_btn = gr.Button("🗑️ Clear", size="sm")
-            
-            answer = gr.Textbox(
-                label="Answer (Ensemble Validated)", 
-                lines=16, 
-                interactive=False, 
-                show_copy_button=True
-            )
-            
-            # Nodal analysis section
-            nodal_btn = gr.Button(
-                "▶️ Run Nodal Analysis", 
-                visible=False, 
-                variant="secondary"
-            )
-            nodal_output = gr.Textbox(
-                label="Nodal Analysis Results", 
-                lines=8, 
-                visible=False,
-                show_copy_button=True
-            )
-    
-    # Event handlers
-    upload_btn.click(
-        fn=store.index_documents, 
-        inputs=files, 
-        outputs=[status, log_box]
-    )
-    
-    query_btn.click(
-        fn=store.query, 
-        inputs=query_text, 
-        outputs=[answer, log_box, nodal_btn]
-    )
-    
-    query_text.submit(
-        fn=store.query, 
-        inputs=query_text, 
-        outputs=[answer, log_box, nodal_btn]
-    )
-    
-    clear_btn.click(
-        fn=lambda: ("", "", gr.update(visible=False)),
-        outputs=[query_text, answer, nodal_btn]
-    )
+            with gr.Column(scale=2):
+                gr.Markdown("### 💬 Ask Your Question")
+                query_text = gr.Textbox(
+                    label="Query", 
+                    lines=2, 
+                    placeholder="e.g., What is total depth of HAG-GT-01?"
+                )
+                
+                with gr.Row():
+                    query_btn = gr.Button("🚀 Ask", variant="primary", size="lg")
+                    clear_btn = gr.Button("🗑️ Clear", size="sm")
+                
+                answer = gr.Textbox(
+                    label="Answer (Ensemble Validated)", 
+                    lines=16, 
+                    interactive=False, 
+                    show_copy_button=True
+                )
+                
+                # Nodal analysis section
+                nodal_btn = gr.Button(
+                    "▶️ Run Nodal Analysis", 
+                    visible=False, 
+                    variant="secondary"
+                )
+                nodal_output = gr.Textbox(
+                    label="Nodal Analysis Results", 
+                    lines=8, 
+                    visible=False,
+                    show_copy_button=True
+                )
+        
+        # Event handlers
+        upload_btn.click(
+            fn=store.index_documents, 
+            inputs=files, 
+            outputs=[status, log_box]
+        )
+        
+        query_btn.click(
+            fn=store.query, 
+            inputs=query_text, 
+            outputs=[answer, log_box, nodal_btn]
+        )
+        
+        query_text.submit(
+            fn=store.query, 
+            inputs=query_text, 
+            outputs=[answer, log_box, nodal_btn]
+        )
+        
+        clear_btn.click(
+            fn=lambda: ("", "", gr.update(visible=False)),
+            outputs=[query_text, answer, nodal_btn]
+        )
+        
+        nodal_btn.click(
+            fn=store.run_nodal_analysis,
+            outputs=nodal_output
+        ).then(
+            fn=lambda: gr.update(visible=True),
+            outputs=nodal_output
+        )
     
-    nodal_btn.click(
-        fn=store.run_nodal_analysis,
-        outputs=nodal_output
-    ).then(
-        fn=lambda: gr.update(visible=True),
-        outputs=nodal_output
-    )
+    return app
 
 if __name__ == "__main__":
     print("="*80)
@@ -469,6 +671,13 @@ if __name__ == "__main__":
     print("✅ Exact document citations")
     print("✅ Multi-turn conversation memory")
     print("✅ Interactive nodal analysis")
+    
+    # Built here, not at import: spawned ingestion/preprocessing workers re-import this module
+    store = DocumentStore()
+    app = build_ui(store)
+    
+    store.warmup()
+    print("🔥 Models warm")
     print("\n🌐 Starting server: http://127.0.0.1:7860")
     print("="*80)
     
@@ -1,18 +1,32 @@
 ﻿"""Chat Memory: Multi-turn conversation support"""
 from typing import List, Dict
-from datetime import datetime
+from collections import OrderedDict, deque
+from functools import lru_cache
+from itertools import islice
+import re
+import time
+
+_DEPTH_RE = re.compile(r'(\d{3,4})\s*m')
+_WELL_RE = re.compile(r'([A-Z]{2,10}-GT-\d{2}(?:-S\d+)?)')
+
+@lru_cache(maxsize=256)
+def _wells_in(query: str) -> tuple:
+    """Well names mentioned in a query (repeated queries skip the regex)"""
+    return tuple(_WELL_RE.findall(query))
 
 class ChatMemory:
     def __init__(self, config):
         self.buffer_size = config['agents']['memory']['buffer_size']
-        self.buffer = []  # Recent messages
-        self.well_context = {}  # Per-well facts
+        self.buffer = deque(maxlen=self.buffer_size)  # Recent messages, oldest evicted
+        self.well_context = OrderedDict()  # Per-well facts, least recently used first
+        self.max_wells = config['agents']['memory'].get('max_wells', 128)
+        self.context_chars = config['agents']['memory'].get('context_chars', 300)
         self.enable_well_context = config['agents']['memory']['enable_well_context']
     
     def add_turn(self, query: str, answer: str, metadata: Dict = None):
         """Add query-answer pair to memory"""
         turn = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': time.time(),  # Epoch seconds; format only if ever displayed
             'query': query,
             'answer': answer[:500],  # Truncate long answers
             'metadata': metadata or {}
@@ -20,21 +34,20 @@ class ChatMemory:
         
         self.buffer.append(turn)
         
-        # Keep only last N turns
-        if len(self.buffer) > self.buffer_size:
-            self.buffer = self.buffer[-self.buffer_size:]
-        
         # Extract and store well-specific facts
         if self.enable_well_context and metadata:
             well_name = metadata.get('well_name')
             if well_name:
                 if well_name not in self.well_context:
                     self.well_context[well_name] = {}
+                    if len(self.well_context) > self.max_wells:
+                        self.well_context.popitem(last=False)  # Evict least recently used well
+                else:
+                    self.well_context.move_to_end(well_name)
                 
                 # Store facts about this well
                 if 'depth' in answer.lower():
-                    import re
-                    depth_match = re.search(r'(\d{3,4})\s*m', answer)
+                    depth_match = _DEPTH_RE.search(answer)
                     if depth_match:
                         self.well_context[well_name]['depth'] = depth_match.group(1)
     
@@ -43,22 +56,30 @@ class ChatMemory:
         if not self.buffer:
             return ""
         
-        # Build context from recent turns
+        # Build context from recent turns, newest first until the character budget is spent
         context_parts = []
-        for turn in self.buffer[-3:]:  # Last 3 turns
-            context_parts.append(f"Previous Q: {turn['query'][:100]}\nA: {turn['answer'][:200]}")
+        budget = self.context_chars
+        for turn in islice(reversed(self.buffer), 3):  # Last 3 turns
+            part = f"Previous Q: {turn['query'][:100]}\nA: {turn['answer'][:200]}"
+            if context_parts and len(part) > budget:
+                break
+            context_parts.append(part[:budget])
+            budget -= len(part) + 2  # Part + separator
+        context_parts.reverse()  # Back to chronological order
         
-        # Add well-specific facts if query mentions a well
-        import re
-        well_matches = re.findall(r'([A-Z]{2,10}-GT-\d{2}(?:-S\d+)?)', query)
-        for well in well_matches:
-            if well in self.well_context:
-                facts = self.well_context[well]
-                context_parts.append(f"\nKnown facts about {well}: {facts}")
+        # Add well-specific facts if query mentions a well (and they still fit)
+        if self.well_context:
+            for well in _wells_in(query):
+                if well in self.well_context:
+                    self.well_context.move_to_end(well)
+                    facts = f"\nKnown facts about {well}: {self.well_context[well]}"
+                    if len(facts) <= budget:
+                        context_parts.append(facts)
+                        budget -= len(facts) + 2
         
         return "\n\n".join(context_parts)
     
     def clear(self):
         """Clear conversation memory"""
-        self.buffer = []
-        self.well_context = {}
+        self.buffer.clear()
+        self.well_context.clear()
@@ -0,0 +1,49 @@
+﻿"""Embedding Cache: SQLite-backed store of chunk embeddings keyed by content hash"""
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+
+_LOOKUP_BATCH = 500  # Keys per SELECT, below SQLite's bound-parameter limit
+
+class EmbeddingCache:
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)'
+            )
+            self._conn.commit()
+    
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """Hash of the embedding model + normalized chunk text (the embedder is uncased)"""
+        payload = f"{model}\0{text.strip().lower()}"
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Cached vectors for the keys that hit"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[start:start + _LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+    
+    def put_many(self, vectors: Dict[str, np.ndarray]):
+        """Store freshly computed vectors"""
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)',
+                ((key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items())
+            )
+            self._conn.commit()
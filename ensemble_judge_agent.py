@@ -1,7 +1,26 @@
 ﻿"""Ensemble Judge: Multi-model validation for higher accuracy"""
-import requests
-from typing import Dict, List
+import logging
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 import statistics
+from agents.judge_cache import JudgeCache
+from agents.ollama_http import create_session, preload_model
+
+_NUMBER_UNIT_RE = re.compile(r'\d+\.?\d*\s*(?:m|meters|bar|°C|kg/m³|TVD|MD)')
+_DATE_RE = re.compile(r'(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}')
+_WELL_RE = re.compile(r'[A-Z]{2,10}-GT-\d{2}(?:-S\d+)?')
+_DIGIT_RE = re.compile(r'\d')
+
+_log = logging.getLogger(__name__)
+
+# One verdict per numbered claim, e.g. "[3] INVALID - context says 2680 m"
+_VERDICT_RE = re.compile(r'^\s*\[(\d+)\]\s*(VALID|UNCERTAIN|INVALID)\b', re.M | re.I)
+
+def _issue_key(issue: str) -> str:
+    """Vote key for an issue: the number of the claim it flags (issues are "[i] INVALID ..." verdict lines)"""
+    return _VERDICT_RE.match(issue).group(1)
 
 class EnsembleJudgeAgent:
     def __init__(self, config):
@@ -9,6 +28,27 @@ class EnsembleJudgeAgent:
         self.ollama_host = config['ollama']['host']
         self.models = config['agents']['judge']['ensemble_models']  # List of models
         self.min_confidence = config['agents']['judge']['min_confidence']
+        self.options = {'temperature': 0.1, 'num_ctx': 4096}
+        self._session = create_session()  # Shared by the concurrent per-model calls
+        self.keep_alive = config['ollama'].get('keep_alive', '30m')
+        num_parallel = config['ollama'].get('num_parallel', 1)
+        max_loaded_models = config['ollama'].get('max_loaded_models', 1)
+        
+        # Only as many models as Ollama keeps resident - preloading more would just evict the first ones
+        for model in self.models[:max_loaded_models]:
+            preload_model(self._session, self.ollama_host, model, self.keep_alive)
+        
+        # Concurrent judge calls only overlap if the Ollama server allows it
+        if len(self.models) > 1 and (num_parallel < 2 or max_loaded_models < len(self.models)):
+            _log.warning(f"Ensemble of {len(self.models)} models will run serially on Ollama "
+                         f"(num_parallel={num_parallel}, max_loaded_models={max_loaded_models}); "
+                         f"start it with OLLAMA_NUM_PARALLEL>=2 OLLAMA_MAX_LOADED_MODELS>={len(self.models)}")
+        if len(self.models) > max_loaded_models:
+            _log.warning(f"Only the first {max_loaded_models} ensemble models are preloaded, "
+                         f"the rest load on first use")
+        
+        judge_config = config['agents']['judge']
+        self.cache = JudgeCache(judge_config['cache_path']) if judge_config.get('cache_enabled', False) else None
     
     def validate(self, answer: str, source_chunks: List[Dict], query: str) -> Dict:
         """Ensemble validation: Multiple models vote"""
@@ -29,48 +69,31 @@ class EnsembleJudgeAgent:
         context = '\n\n'.join([f"[Chunk {i+1}] {c['content'][:500]}" 
                                for i, c in enumerate(source_chunks[:8])])
         
+        # Number the claims so one call validates the whole batch
+        numbered_claims = '\n'.join(f"[{i+1}] {claim}" for i, claim in enumerate(claims[:10]))
+        
         validation_prompt = f"""Fact checker. Verify claims against context.
 
-For each claim:
+For each claim answer with its number and one verdict:
 - VALID: Directly supported
 - UNCERTAIN: Partially supported
 - INVALID: Contradicts or missing
 
+Format: [number] VALID|UNCERTAIN|INVALID - short reason
+
 Claims to check:
-{' | '.join(claims[:10])}
+{numbered_claims}
 
 Context:
 {context}
 
-Validation (one per claim):
+Validation (one line per claim):
 """
         
-        # Get validations from multiple models
-        validations = []
-        for model in self.models:
-            try:
-                resp = requests.post(
-                    f"{self.ollama_host}/api/generate",
-                    json={
-                        'model': model,
-                        'prompt': validation_prompt,
-                        'stream': False,
-                        'options': {'temperature': 0.1, 'num_ctx': 4096}
-                    },
-                    timeout=90
-                )
-                
-                if resp.status_code == 200:
-                    validation = resp.json().get('response', '')
-                    confidence = self._calculate_confidence(validation)
-                    validations.append({
-                        'model': model,
-                        'confidence': confidence,
-                        'validation': validation
-                    })
-            
-            except Exception as e:
-                continue
+        # Get validations from multiple models (concurrently - wall time is the slowest model)
+        with ThreadPoolExecutor(max_workers=len(self.models)) as pool:
+            results = pool.map(lambda m: self._query_model(m, validation_prompt), self.models)
+            validations = [v for v in results if v is not None]
         
         if not validations:
             # All judges failed - assume valid
@@ -86,15 +109,20 @@ Validation (one per claim):
         confidences = [v['confidence'] for v in validations]
         ensemble_confidence = statistics.mean(confidences)
         
-        # Majority voting for issues
-        all_issues = []
+        # Majority voting for issues - models agree if they flag the same claim,
+        # whatever wording they use; the first model's line is kept for display
+        issue_counts = Counter()
+        issue_text = {}
         for v in validations:
-            all_issues.extend(self._extract_issues(v['validation']))
+            keys = []
+            for issue in self._extract_issues(v['validation']):
+                key = _issue_key(issue)
+                issue_text.setdefault(key, issue)
+                keys.append(key)
+            issue_counts.update(set(keys))  # One vote per model
         
         # Issues mentioned by majority
-        from collections import Counter
-        issue_counts = Counter(all_issues)
-        flagged_issues = [issue for issue, count in issue_counts.items() 
+        flagged_issues = [issue_text[key] for key, count in issue_counts.items() 
                          if count >= len(validations) / 2]
         
         return {
@@ -106,32 +134,73 @@ Validation (one per claim):
                               for v in validations]
         }
     
+    def _query_model(self, model: str, prompt: str) -> Optional[Dict]:
+        """Ask one ensemble model for a validation, None if the judge failed"""
+        try:
+            # Identical (model, prompt, options) -> reuse the earlier verdict
+            cache_key = JudgeCache.make_key(model, prompt, self.options)
+            validation = self.cache.get(cache_key) if self.cache else None
+            
+            if validation is None:
+                resp = self._session.post(
+                    f"{self.ollama_host}/api/generate",
+                    json={
+                        'model': model,
+                        'prompt': prompt,
+                        'stream': False,
+                        'keep_alive': self.keep_alive,
+                        'options': self.options
+                    },
+                    timeout=90
+                )
+                
+                if resp.status_code != 200:
+                    return None
+                
+                validation = resp.json().get('response', '')
+                if self.cache:
+                    self.cache.put(cache_key, validation)
+            
+            return {
+                'model': model,
+                'confidence': self._calculate_confidence(validation),
+                'validation': validation
+            }
+        
+        except Exception as e:
+            return None
+    
     def _extract_claims(self, answer: str) -> List[str]:
         """Extract factual claims"""
-        import re
         claims = []
-        claims.extend(re.findall(r'\d+\.?\d*\s*(?:m|meters|bar|°C|kg/m³|TVD|MD)', answer))
-        claims.extend(re.findall(r'(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}', answer))
-        claims.extend(re.findall(r'[A-Z]{2,10}-GT-\d{2}(?:-S\d+)?', answer))
+        answer = answer[:4096]  # Bound the scan on runaway answers
+        
+        # Every claim pattern needs a digit - plain chat answers skip all scans
+        if not _DIGIT_RE.search(answer):
+            return claims
+        
+        claims.extend(_NUMBER_UNIT_RE.findall(answer))
+        claims.extend(_DATE_RE.findall(answer))
+        if 'GT-' in answer:
+            claims.extend(_WELL_RE.findall(answer))
         return claims[:15]
     
     def _calculate_confidence(self, validation_text: str) -> float:
-        """Calculate confidence from validation text"""
-        valid_count = validation_text.upper().count('VALID:')
-        invalid_count = validation_text.upper().count('INVALID:')
-        uncertain_count = validation_text.upper().count('UNCERTAIN:')
+        """Calculate confidence from the per-claim [i] verdicts"""
+        verdicts = [verdict.upper() for _, verdict in _VERDICT_RE.findall(validation_text)]
         
-        total = valid_count + invalid_count + uncertain_count
+        total = len(verdicts)
         if total == 0:
             return 0.8
         
-        return (valid_count + 0.5 * uncertain_count) / total
+        return (verdicts.count('VALID') + 0.5 * verdicts.count('UNCERTAIN')) / total
     
     def _extract_issues(self, validation_text: str) -> List[str]:
         """Extract flagged issues"""
         issues = []
         lines = validation_text.split('\n')
         for line in lines:
-            if 'INVALID' in line.upper():
+            match = _VERDICT_RE.match(line)
+            if match and match.group(2).upper() == 'INVALID':
                 issues.append(line.strip()[:80])
         return issues
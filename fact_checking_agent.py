@@ -1,6 +1,7 @@
 ﻿"""Fact Checking Agent: Validates and cleans facts from query outputs"""
 import re
 from typing import List, Dict
+import numpy as np
 
 class FactCheckingAgent:
     def __init__(self, config):
@@ -25,14 +26,15 @@ class FactCheckingAgent:
         # Simple rule to detect anomalies: get mean and report values far from mean
         final_results = []
         for key, vals in consolidated.items():
-            import statistics
-            mean_val = statistics.mean(vals)
-            for v in vals:
-                if abs(v - mean_val) / mean_val > 0.2:  # >20% deviation flag
-                    issues.append(f"Fact anomaly: {v} {key} deviates from mean {mean_val:.2f} {key}")
+            values = np.asarray(vals, dtype=np.float64)
+            mean_val = values.mean()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                deviation = np.abs(values - mean_val) / mean_val
+            for v in values[deviation > 0.2].tolist():  # >20% deviation flag
+                issues.append(f"Fact anomaly: {v} {key} deviates from mean {mean_val:.2f} {key}")
 
             # Use median as final fact value
-            median_val = statistics.median(vals)
+            median_val = float(np.median(values))
             final_results.append(f"Verified median {key}: {median_val}")
 
         # Format issues and facts into final report
@@ -1,74 +1,96 @@
 ﻿"""Generic Ingestion Agent - Works with any well report format"""
 import fitz
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import re
 
+# Plain text extraction; ligatures are expanded so "fi"/"fl" match like normal letters
+_TEXT_FLAGS = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP | fitz.TEXT_CID_FOR_UNKNOWN_UNICODE
+
+# Well names in a single pass over the document text
+_WELL_NAME_RE = re.compile(
+    r'\b(?:(?P<standard>[A-Z]{2,4}-GT-\d{2}(?:-S\d+)?(?:-\d{2})?)'  # ADK-GT-01, NLW-GT-03-S1, HAG-GT-01-02
+    r'|(?P<long>[A-Z]{4,}-GT-\d{2}(?:-S\d+)?)'                       # NAALDWIJK-GT-02-S1
+    r'|(?P<prefix>[A-Z]{2,4})\s+GT\s+(?P<number>\d{2}))\b'           # HAG GT 01
+)
+
+def _process_file(fp):
+    """Ingest one PDF (runs in a worker process).
+    
+    Returns (document or None, log messages) - log_capture can't cross processes,
+    so messages are handed back and replayed by the caller.
+    """
+    name = Path(fp).name
+    logs = [(f"📄 Processing: {name}", "INFO")]
+    
+    try:
+        with fitz.open(fp) as pdf:
+            pages = []
+            
+            for page in pdf.pages():
+                pages.append({
+                    'page_number': page.number + 1,
+                    'content': page.get_text("text", flags=_TEXT_FLAGS)
+                })
+        
+        # ENHANCEMENT 3: Generic well name extraction
+        full_text = "".join(p['content'] for p in pages)
+        wells = IngestionAgent._extract_well_names(full_text)
+        
+        logs.append((f"✓ {len(pages)} pages, Wells: {', '.join(wells) if wells else 'None'}", "INFO"))
+        
+        return {
+            'source_file': name,
+            'wells': wells,  # Normalized list, for callers that need the names themselves
+            'metadata': {
+                'source_file': name,
+                'well_names': ', '.join(wells)  # Convert to string for ChromaDB
+            },
+            'pages': pages
+        }, logs
+    
+    except Exception as e:
+        logs.append((f"❌ Failed: {name} - {str(e)[:100]}", "ERROR"))
+        return None, logs
+
 class IngestionAgent:
     def __init__(self, config):
         self.config = config
     
     def process(self, file_paths, log_capture=None):
-        """Process PDFs with generic well name detection"""
+        """Process PDFs with generic well name detection (one worker process per file)"""
         documents = []
         
-        for fp in file_paths:
-            try:
-                if log_capture:
-                    log_capture.add(f"📄 Processing: {Path(fp).name}", "INFO")
-                
-                pdf = fitz.open(fp)
-                pages = []
-                full_text = ""
-                
-                for i in range(len(pdf)):
-                    text = pdf[i].get_text()
-                    pages.append({
-                        'page_number': i + 1,
-                        'content': text
-                    })
-                    full_text += text
-                
-                # ENHANCEMENT 3: Generic well name extraction
-                wells = self._extract_well_names(full_text)
-                
-                if log_capture:
-                    log_capture.add(f"✓ {len(pages)} pages, Wells: {', '.join(wells) if wells else 'None'}", "INFO")
-                
-                documents.append({
-                    'source_file': Path(fp).name,
-                    'metadata': {
-                        'source_file': Path(fp).name,
-                        'well_names': ', '.join(wells)  # Convert to string for ChromaDB
-                    },
-                    'pages': pages
-                })
-                
-                pdf.close()
-                
-            except Exception as e:
-                if log_capture:
-                    log_capture.add(f"❌ Failed: {Path(fp).name} - {str(e)[:100]}", "ERROR")
+        def collect(doc, logs):
+            if log_capture:
+                log_capture.add_many(logs)
+            if doc is not None:
+                documents.append(doc)
+        
+        # Capped pool - every worker holds a whole parsed PDF in memory
+        num_workers = self.config['agents'].get('ingestion', {}).get('num_workers', 8) or os.cpu_count() or 1
+        workers = min(len(file_paths), num_workers)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for doc, logs in pool.map(_process_file, file_paths):
+                    collect(doc, logs)  # In upload order, as soon as each file is done
+        else:
+            for fp in file_paths:
+                collect(*_process_file(fp))
         
         return {'documents': documents}
     
-    def _extract_well_names(self, text: str) -> list:
+    @staticmethod
+    def _extract_well_names(text: str) -> list:
         """Extract well names using multiple patterns"""
         well_names = set()
         
-        # Pattern 1: Standard (ADK-GT-01, NLW-GT-03-S1, HAG-GT-01-02)
-        pattern1 = r'\b([A-Z]{2,4}-GT-\d{2}(?:-S\d+)?(?:-\d{2})?)\b'
-        wells1 = re.findall(pattern1, text)
-        well_names.update(wells1)
-        
-        # Pattern 2: Naaldwijk style (NAALDWIJK-GT-02-S1)
-        pattern2 = r'\b([A-Z]{4,}-GT-\d{2}(?:-S\d+)?)\b'
-        wells2 = re.findall(pattern2, text)
-        well_names.update(wells2)
-        
-        # Pattern 3: With spaces (HAG GT 01)
-        pattern3 = r'\b([A-Z]{2,4})\s+GT\s+(\d{2})\b'
-        for match in re.finditer(pattern3, text):
-            well_name = f"{match.group(1)}-GT-{match.group(2)}"
-            well_names.add(well_name)
+        for match in _WELL_NAME_RE.finditer(text):
+            if match.group('prefix'):
+                # With spaces (HAG GT 01) -> normalised to HAG-GT-01
+                well_names.add(f"{match.group('prefix')}-GT-{match.group('number')}")
+            else:
+                well_names.add(match.group(match.lastgroup))
         
         return sorted(list(well_names))
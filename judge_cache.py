@@ -0,0 +1,38 @@
+﻿"""Judge Cache: SQLite-backed store of judge LLM responses"""
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+class JudgeCache:
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # One connection shared by the ensemble's worker threads, serialized by a lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)'
+            )
+            self._conn.commit()
+    
+    @staticmethod
+    def make_key(model: str, prompt: str, options: Dict) -> str:
+        """Hash of everything that determines the judge's answer"""
+        payload = f"{model}\0{prompt}\0{json.dumps(options, sort_keys=True)}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Cached response text, or None on a miss"""
+        with self._lock:
+            row = self._conn.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+    
+    def put(self, key: str, response: str):
+        """Store a judge response"""
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)', (key, response))
+            self._conn.commit()
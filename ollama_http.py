@@ -0,0 +1,28 @@
+﻿"""Ollama HTTP: Shared connection-pooled session setup for agent LLM calls"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+def create_session(pool_connections: int = 8, pool_maxsize: int = 32) -> requests.Session:
+    """Keep-alive session; urllib3 only retries POSTs that never reached Ollama (connect errors)"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=2, backoff_factor=0.2)
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def preload_model(session: requests.Session, host: str, model: str, keep_alive: str):
+    """Load a model in the background so the first real call skips Ollama's cold start"""
+    def _load():
+        try:
+            # A generate request without a prompt only loads the model
+            session.post(f"{host}/api/generate", json={'model': model, 'keep_alive': keep_alive}, timeout=120)
+        except requests.RequestException:
+            pass  # Best effort - the real call will load it anyway
+    
+    threading.Thread(target=_load, daemon=True).start()
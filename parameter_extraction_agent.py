@@ -1,13 +1,66 @@
 ﻿"""Enhanced Parameter Extraction: Advanced Trajectory Detection"""
+import heapq
 import re
+from operator import itemgetter
 from typing import List, Dict
-import requests
+import numpy as np
+from agents.ollama_http import create_session, preload_model
+
+# Trajectory table detection: all indicators in one alternation, scored once per group.
+# The header alternative comes first and also implies MD and TVD. Lookaheads keep the
+# header and "true vertical" matches from swallowing text another indicator needs.
+_TRAJECTORY_INDICATORS_RE = re.compile(
+    r'(?P<header>MD\s*TVD(?=\s*(?:Incl|Inc|Angle)))'
+    r'|(?P<md>(?i:measured\s+depth|MD|depth\s+\(m\)))'
+    r'|(?P<tvd>(?i:true\s+vertical(?=\s+depth)|TVD))'
+    r'|(?P<angle>(?i:inclination|azimuth|angle))'
+    r'|(?P<row>\d{3,4}\.\d+\s+\d{3,4}\.\d+\s+\d+\.\d+)'  # Pattern: 1000.5 950.2 15.3
+)
+_INDICATOR_HITS = {
+    'header': ('header', 'md', 'tvd'),
+    'md': ('md',),
+    'tvd': ('tvd',),
+    'angle': ('angle',),
+    'row': ('row',)
+}
+_NUMERIC_LINE_RE = re.compile(r'\d{3,4}\.?\d*\s+\d{3,4}\.?\d*')
+_DIGIT_RE = re.compile(r'\d')
+
+# Column order of the trajectory array returned by extract()
+TRAJECTORY_COLUMNS = ('MD', 'TVD', 'ID')
+
+# Trajectory point extraction: table rows with | separators or space-separated rows
+_TRAJECTORY_ROW_RE = re.compile(
+    r'\|\s*(?P<t_md>\d{1,4}\.?\d*)\s*\|\s*(?P<t_tvd>\d{1,4}\.?\d*)\s*\|\s*(?P<t_id>\d+\.?\d*)'
+    r'|(?:^|\n)\s*(?P<md>\d{3,4}\.?\d*)\s+(?P<tvd>\d{3,4}\.?\d*)\s+(?P<id>\d+\.?\d*)',
+    re.MULTILINE
+)
+
+def _clean_trajectory_indices(md: np.ndarray, tvd: np.ndarray) -> np.ndarray:
+    """Indices of the points that survive dedup + MD-monotonic validation, in MD order"""
+    # Remove duplicates (first occurrence of each 0.1 m rounded MD/TVD pair)
+    keys = np.column_stack((np.round(md, 1), np.round(tvd, 1)))
+    _, first = np.unique(keys, axis=0, return_index=True)
+    first.sort()
+    
+    # Sort by MD (stable, so ties keep extraction order)
+    order = first[np.argsort(md[first], kind='stable')]
+    
+    # Validate sequence: TVD <= MD, MD strictly increasing from 0
+    order = order[(md[order] > 0) & (tvd[order] <= md[order])]
+    increasing = np.empty(len(order), dtype=bool)
+    increasing[:1] = True
+    np.greater(md[order[1:]], md[order[:-1]], out=increasing[1:])
+    return order[increasing]
 
 class ParameterExtractionAgent:
     def __init__(self, config):
         self.config = config
         self.ollama_host = config['ollama']['host']
         self.model = config['ollama']['model_extraction']
+        self._session = create_session()
+        self.keep_alive = config['ollama'].get('keep_alive', '30m')
+        preload_model(self._session, self.ollama_host, self.model, self.keep_alive)
     
     def extract(self, chunks: List[Dict], log_capture=None) -> Dict:
         """Extract trajectory with advanced table detection"""
@@ -21,106 +74,93 @@ class ParameterExtractionAgent:
         if not trajectory_chunks:
             if log_capture:
                 log_capture.add("⚠️  No trajectory tables detected", "WARN")
-            return {'trajectory': [], 'confidence': 0.0}
+            return {'trajectory_array': np.empty((0, 3)), 'columns': TRAJECTORY_COLUMNS, 'confidence': 0.0}
         
         if log_capture:
             log_capture.add(f"✓ Found {len(trajectory_chunks)} potential trajectory chunks", "INFO")
         
-        # Step 2: Extract MD/TVD/ID data using regex
-        trajectory_points = []
-        for chunk in trajectory_chunks[:10]:  # Process top 10 candidates
-            points = self._extract_trajectory_points(chunk['content'])
-            trajectory_points.extend(points)
+        # Step 2: Extract MD/TVD/ID rows using regex (top 10 candidates)
+        trajectory = np.concatenate([self._extract_trajectory_points(chunk['content'])
+                                     for chunk in trajectory_chunks[:10]])
         
-        if not trajectory_points:
+        if not len(trajectory):
             # Step 3: Fallback - use LLM extraction
             if log_capture:
                 log_capture.add("🤖 Using LLM for trajectory extraction", "INFO")
-            trajectory_points = self._llm_extract_trajectory(trajectory_chunks[:5])
+            trajectory = self._llm_extract_trajectory(trajectory_chunks[:5])
         
         # Step 4: Clean and validate
-        trajectory_points = self._clean_trajectory(trajectory_points)
+        trajectory = self._clean_trajectory(trajectory)
         
         if log_capture:
-            log_capture.add(f"✅ Extracted {len(trajectory_points)} trajectory points", "SUCCESS")
+            log_capture.add(f"✅ Extracted {len(trajectory)} trajectory points", "SUCCESS")
         
         return {
-            'trajectory': trajectory_points,
-            'confidence': min(0.9, len(trajectory_points) / 50),  # Confidence based on point count
+            'trajectory_array': trajectory,  # (N, 3) float64, columns MD/TVD/ID
+            'columns': TRAJECTORY_COLUMNS,
+            'confidence': min(0.9, len(trajectory) / 50),  # Confidence based on point count
             'source_chunks': len(trajectory_chunks)
         }
     
     def _detect_trajectory_tables(self, chunks: List[Dict]) -> List[Dict]:
         """Detect chunks containing trajectory data"""
-        trajectory_patterns = [
-            r'(?i)(measured\s+depth|MD|depth\s+\(m\))',
-            r'(?i)(true\s+vertical\s+depth|TVD)',
-            r'(?i)(inclination|azimuth|angle)',
-            r'MD\s*TVD\s*(?:Incl|Inc|Angle)',
-            r'\d{3,4}\.\d+\s+\d{3,4}\.\d+\s+\d+\.\d+'  # Pattern: 1000.5 950.2 15.3
-        ]
-        
         scored_chunks = []
         for chunk in chunks:
             content = chunk['content']
             score = 0
             
-            # Score based on pattern matches
-            for pattern in trajectory_patterns:
-                if re.search(pattern, content):
-                    score += 1
+            # No digits, no trajectory values - skip the scoring scans
+            if not _DIGIT_RE.search(content):
+                continue
+            
+            # Score based on pattern matches (one point per indicator, single scan)
+            found = set()
+            for match in _TRAJECTORY_INDICATORS_RE.finditer(content):
+                found.update(_INDICATOR_HITS[match.lastgroup])
+                if len(found) == len(_INDICATOR_HITS):
+                    break
+            score += len(found)
             
             # Bonus: Has table structure
             if '|' in content or '\t' in content:
                 score += 2
             
-            # Bonus: Multiple numeric lines
-            numeric_lines = len(re.findall(r'\d{3,4}\.?\d*\s+\d{3,4}\.?\d*', content))
-            score += min(numeric_lines, 5)
+            # Bonus: Multiple numeric lines (capped at 5, so stop counting there)
+            numeric_lines = 0
+            for _ in _NUMERIC_LINE_RE.finditer(content):
+                numeric_lines += 1
+                if numeric_lines >= 5:
+                    break
+            score += numeric_lines
             
             if score >= 3:
                 scored_chunks.append({'chunk': chunk, 'score': score})
         
-        # Sort by score and return top candidates
-        scored_chunks.sort(key=lambda x: x['score'], reverse=True)
-        return [item['chunk'] for item in scored_chunks[:15]]
+        # Top candidates by score (same order as a stable sort, without sorting everything)
+        top = heapq.nlargest(15, scored_chunks, key=itemgetter('score'))
+        return [item['chunk'] for item in top]
     
-    def _extract_trajectory_points(self, text: str) -> List[Dict]:
-        """Extract MD/TVD/ID from text using regex"""
-        points = []
-        
-        # Pattern 1: Table format with | separators
-        table_pattern = r'\|\s*(\d{1,4}\.?\d*)\s*\|\s*(\d{1,4}\.?\d*)\s*\|\s*(\d+\.?\d*)'
-        matches = re.findall(table_pattern, text)
-        for md, tvd, inc_or_id in matches:
-            try:
-                points.append({
-                    'MD': float(md),
-                    'TVD': float(tvd),
-                    'ID': float(inc_or_id) if float(inc_or_id) < 90 else 0.0  # Filter inclination
-                })
-            except ValueError:
-                continue
-        
-        # Pattern 2: Space-separated (more common)
-        space_pattern = r'(?:^|\n)\s*(\d{3,4}\.?\d*)\s+(\d{3,4}\.?\d*)\s+(\d+\.?\d*)'
-        matches = re.findall(space_pattern, text, re.MULTILINE)
-        for md, tvd, inc_or_id in matches:
-            try:
-                md_val, tvd_val = float(md), float(tvd)
-                # Validate: TVD should be <= MD
-                if tvd_val <= md_val and md_val < 5000:
-                    points.append({
-                        'MD': md_val,
-                        'TVD': tvd_val,
-                        'ID': float(inc_or_id) if float(inc_or_id) < 90 else 0.0
-                    })
-            except ValueError:
-                continue
-        
-        return points
+    def _extract_trajectory_points(self, text: str) -> np.ndarray:
+        """Extract MD/TVD/ID rows from text using regex"""
+        # Each match fills either the table (t_*) or the space-separated group triple
+        matches = _TRAJECTORY_ROW_RE.findall(text)
+        if not matches:
+            return np.empty((0, 3))
+        
+        # Table rows before space-separated rows (stable), so dedup keeps the table's copy of a point
+        raw = np.array(matches)
+        raw = raw[np.argsort(raw[:, 0] == '', kind='stable')]
+        is_table = raw[:, 0] != ''
+        values = np.where(is_table[:, None], raw[:, :3], raw[:, 3:]).astype(np.float64)
+        md, tvd, inc_or_id = values.T
+        
+        # Table rows are taken as-is; space-separated rows need TVD <= MD and MD < 5000
+        keep = is_table | ((tvd <= md) & (md < 5000))
+        ids = np.where(inc_or_id < 90, inc_or_id, 0.0)  # Filter inclination
+        
+        return np.column_stack((md[keep], tvd[keep], ids[keep]))
     
-    def _llm_extract_trajectory(self, chunks: List[Dict]) -> List[Dict]:
+    def _llm_extract_trajectory(self, chunks: List[Dict]) -> np.ndarray:
         """Fallback: Use LLM to extract trajectory"""
         context = '\n\n'.join([c['content'][:800] for c in chunks[:3]])
         
@@ -138,9 +178,10 @@ Example:
 """
         
         try:
-            resp = requests.post(
+            resp = self._session.post(
                 f"{self.ollama_host}/api/generate",
                 json={'model': self.model, 'prompt': prompt, 'stream': False,
+                      'keep_alive': self.keep_alive,
                       'options': {'temperature': 0.1, 'num_ctx': 4096}},
                 timeout=120
             )
@@ -153,39 +194,23 @@ Example:
                     try:
                         parts = line.strip().split(',')
                         if len(parts) >= 2:
-                            points.append({
-                                'MD': float(parts[0]),
-                                'TVD': float(parts[1]),
-                                'ID': float(parts[2]) if len(parts) > 2 else 0.216
-                            })
+                            points.append((
+                                float(parts[0]),
+                                float(parts[1]),
+                                float(parts[2]) if len(parts) > 2 else 0.216
+                            ))
                     except (ValueError, IndexError):
                         continue
             
-            return points
+            return np.array(points, dtype=np.float64).reshape(-1, 3)
         
         except Exception as e:
-            return []
+            return np.empty((0, 3))
     
-    def _clean_trajectory(self, points: List[Dict]) -> List[Dict]:
-        """Clean and deduplicate trajectory points"""
-        # Remove duplicates
-        seen = set()
-        cleaned = []
-        for p in points:
-            key = (round(p['MD'], 1), round(p['TVD'], 1))
-            if key not in seen:
-                seen.add(key)
-                cleaned.append(p)
-        
-        # Sort by MD
-        cleaned.sort(key=lambda x: x['MD'])
-        
-        # Validate sequence
-        final = []
-        prev_md = 0
-        for p in cleaned:
-            if p['MD'] > prev_md and p['TVD'] <= p['MD']:
-                final.append(p)
-                prev_md = p['MD']
-        
-        return final[:100]  # Limit to 100 points
+    def _clean_trajectory(self, trajectory: np.ndarray) -> np.ndarray:
+        """Clean and deduplicate trajectory rows"""
+        if not len(trajectory):
+            return trajectory
+        
+        keep = _clean_trajectory_indices(trajectory[:, 0], trajectory[:, 1])
+        return trajectory[keep[:100]]  # Limit to 100 points
@@ -1,8 +1,29 @@
 ﻿"""Enhanced RAG Retrieval - FIXED metadata filtering"""
 import chromadb
+from chromadb.utils import embedding_functions
 from rank_bm25 import BM25Okapi
 import numpy as np
+import orjson
 import time
+from collections import OrderedDict
+from operator import itemgetter
+from pathlib import Path
+from agents.embedding_cache import EmbeddingCache
+
+# What the default ONNX embedder raises when a batch doesn't fit: ONNX Runtime reports
+# allocation failures as its own RUNTIME_EXCEPTION/FAIL errors, not as MemoryError
+try:
+    from onnxruntime.capi.onnxruntime_pybind11_state import Fail as _OrtFail, \
+        RuntimeException as _OrtRuntimeException
+    _EMBED_OOM_ERRORS = (MemoryError, RuntimeError, _OrtFail, _OrtRuntimeException)
+except ImportError:
+    _EMBED_OOM_ERRORS = (MemoryError, RuntimeError)
+
+_MIN_EMBED_BATCH_SIZE = 16  # Smaller batches won't fix a failing embedder, so the error is raised
+
+def _well_flag(well_name):
+    """Metadata key flagging chunks about one well - Chroma filters on scalars, not list contents"""
+    return f"has_well_{well_name.strip().upper()}"
 
 class RAGRetrievalAgent:
     def __init__(self, config):
@@ -11,83 +32,197 @@ class RAGRetrievalAgent:
         self.collections = {}
         self.bm25_indices = {}
         self.documents_cache = {}
-    
-    def index_documents(self, chunks, strategy='factual_qa'):
-        collection_name = self.config['embedding_strategies'][strategy]['collection']
+        self.bm25_corpora = {}  # collection -> tokenized chunks the BM25 index was built from
+        self._bm25_score_cache = OrderedDict()  # (collection, query) -> BM25 scores, least recently used first
+        self.bm25_cache_size = config['agents']['rag_retrieval'].get('bm25_cache_size', 512)
+        self._mode_settings = {}  # mode -> (collection, top_k, semantic weight, keyword weight)
+        # Chroma's default embedder, called directly so indexing controls the batch sizes
+        self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        self.embedding_model = getattr(self.embedding_function, 'MODEL_NAME', type(self.embedding_function).__name__)
+        
+        rag_config = config['agents']['rag_retrieval']
+        self.embedding_cache = EmbeddingCache(rag_config['embedding_cache_path']) \
+            if rag_config.get('embedding_cache_enabled', False) else None
         
-        if collection_name not in self.collections:
+        # BM25 corpora are saved next to the Chroma store, so hybrid search survives a restart;
+        # plain JSON data, the index itself is rebuilt on load
+        self.bm25_dir = Path(config['vector_store']['path'])
+        for path in self.bm25_dir.glob('*.bm25.json'):
+            collection_name = path.name[:-len('.bm25.json')]
+            saved = orjson.loads(path.read_bytes())
+            self.bm25_corpora[collection_name] = saved['tokenized']
+            self.bm25_indices[collection_name] = BM25Okapi(saved['tokenized'])
+            self.documents_cache[collection_name] = saved['chunks']
             self.collections[collection_name] = self.client.get_or_create_collection(
                 name=collection_name,
-                metadata={"strategy": strategy}
+                embedding_function=self.embedding_function
             )
+    
+    def index_documents(self, chunks, strategy='factual_qa'):
+        self.index_documents_batched({strategy: chunks})
+    
+    def index_documents_batched(self, chunks_by_strategy, embed_batch_size=None):
+        """Index several strategies at once - one stream of fixed-size embedding batches,
+        split back into the per-strategy collections"""
+        batch_size = embed_batch_size or self.config['agents']['rag_retrieval'].get('embed_batch_size', 512)
         
-        collection = self.collections[collection_name]
+        texts = [text for chunks in chunks_by_strategy.values() for text in map(itemgetter('content'), chunks)]
+        embeddings = self._embed(texts, batch_size)
         
-        documents = [c['content'] for c in chunks]
-        metadatas = [c['metadata'] for c in chunks]
-        ids = [f"{strategy}_{i}_{int(time.time())}" for i in range(len(chunks))]
+        offset = 0
+        for strategy, chunks in chunks_by_strategy.items():
+            documents = texts[offset:offset + len(chunks)]
+            vectors = embeddings[offset:offset + len(chunks)]
+            offset += len(chunks)
+            if not chunks:
+                continue
+            
+            collection_name = self.config['embedding_strategies'][strategy]['collection']
+            
+            if collection_name not in self.collections:
+                self.collections[collection_name] = self.client.get_or_create_collection(
+                    name=collection_name,
+                    metadata={"strategy": strategy},
+                    embedding_function=self.embedding_function
+                )
+            
+            collection = self.collections[collection_name]
+            
+            metadatas = list(map(itemgetter('metadata'), chunks))
+            for meta in metadatas:
+                for well in meta.get('well_names', '').split(','):
+                    if well.strip():
+                        meta[_well_flag(well)] = True  # Exact-match target for the retrieval where filter
+            # Timestamped per upload and numbered on from what Chroma already holds, so a new id never
+            # matches a stored one (Chroma would silently drop the chunk) whatever the BM25 file says
+            id_prefix = f"{strategy}_{int(time.time())}_"
+            first_id = collection.count()
+            ids = [id_prefix + str(i) for i in range(first_id, first_id + len(chunks))]
+            
+            for start in range(0, len(chunks), batch_size):
+                end = start + batch_size
+                collection.add(documents=documents[start:end], embeddings=vectors[start:end],
+                               metadatas=metadatas[start:end], ids=ids[start:end])
+            
+            # BM25 index over everything in the collection, earlier uploads included
+            tokenized_docs = self.bm25_corpora.get(collection_name, []) + \
+                list(map(str.split, map(str.lower, documents)))
+            all_chunks = self.documents_cache.get(collection_name, []) + chunks
+            self.bm25_corpora[collection_name] = tokenized_docs
+            self.bm25_indices[collection_name] = BM25Okapi(tokenized_docs)
+            self._bm25_score_cache.clear()  # Scores came from the replaced index
+            self.documents_cache[collection_name] = all_chunks
+            
+            # Written aside and renamed, so a crash mid-write can't leave a truncated file behind
+            path = self.bm25_dir / f"{collection_name}.bm25.json"
+            tmp_path = path.with_suffix('.tmp')
+            tmp_path.write_bytes(orjson.dumps({'tokenized': tokenized_docs, 'chunks': all_chunks}))
+            tmp_path.replace(path)
+            
+            print(f"  ✅ Indexed {len(chunks)} chunks into {collection_name} (Hybrid)")
+    
+    def _embed(self, texts, batch_size):
+        """Embed texts, reusing cached vectors and embedding each distinct missing text once"""
+        if self.embedding_cache is None:
+            return self._embed_batches(texts, batch_size)
         
-        collection.add(documents=documents, metadatas=metadatas, ids=ids)
+        keys = [EmbeddingCache.make_key(self.embedding_model, text) for text in texts]
+        vectors = self.embedding_cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
         
-        # BM25 index
-        tokenized_docs = [doc.lower().split() for doc in documents]
-        self.bm25_indices[collection_name] = BM25Okapi(tokenized_docs)
-        self.documents_cache[collection_name] = chunks
+        if missing:
+            fresh = dict(zip(missing, self._embed_batches(list(missing.values()), batch_size)))
+            self.embedding_cache.put_many(fresh)
+            vectors.update(fresh)
         
-        print(f"  ✅ Indexed {len(chunks)} chunks into {collection_name} (Hybrid)")
+        return [vectors[key] for key in keys]
+    
+    def _embed_batches(self, texts, batch_size):
+        """Embed texts in fixed-size batches, halving the batch size whenever one fails to allocate"""
+        embeddings = []
+        start = 0
+        while start < len(texts):
+            try:
+                embeddings.extend(self.embedding_function(texts[start:start + batch_size]))
+            except _EMBED_OOM_ERRORS:
+                if batch_size <= _MIN_EMBED_BATCH_SIZE:
+                    raise
+                batch_size = max(batch_size // 2, _MIN_EMBED_BATCH_SIZE)
+                continue
+            start += batch_size
+        return embeddings
     
     def retrieve(self, query, mode='qa', well_name=None):
-        """Hybrid retrieval - FIXED: removed $contains filter"""
-        strategy_map = {'qa': 'factual_qa', 'extract': 'technical_extraction', 'summary': 'summary'}
-        strategy = strategy_map.get(mode, 'factual_qa')
-        collection_name = self.config['embedding_strategies'][strategy]['collection']
-        top_k_key = f"top_k_{mode if mode != 'qa' else 'factual'}"
-        top_k = self.config['agents']['rag_retrieval'][top_k_key]
+        """Hybrid retrieval - well filter as an exact-match where on the per-well flags"""
+        settings = self._mode_settings.get(mode)
+        if settings is None:
+            settings = self._mode_settings[mode] = self._resolve_mode(mode)
+        collection_name, top_k, semantic_weight, keyword_weight = settings
         
         collection = self.collections.get(collection_name)
         if not collection:
             return {'chunks': []}
         
-        # Semantic search (NO metadata filtering - ChromaDB limitation)
+        # Semantic search, filtered inside Chroma so every candidate is about the target well
         semantic_results = collection.query(
             query_texts=[query],
-            n_results=top_k * 2
+            n_results=top_k * 2,
+            where={_well_flag(well_name): True} if well_name else None
         )
         
         # BM25 keyword search
         bm25 = self.bm25_indices.get(collection_name)
         keyword_scores = []
         if bm25:
-            tokenized_query = query.lower().split()
-            keyword_scores = bm25.get_scores(tokenized_query)
+            keyword_scores = self._bm25_scores(bm25, collection_name, query)
         
         # Hybrid fusion
-        semantic_weight = self.config['agents']['rag_retrieval']['hybrid_weight_semantic']
-        keyword_weight = self.config['agents']['rag_retrieval']['hybrid_weight_keyword']
+        documents = semantic_results['documents'][0]
+        metadatas = semantic_results['metadatas'][0]
+        distances = np.asarray(semantic_results['distances'][0], dtype=np.float64)
+        
+        # Scores for all candidates at once (keyword score 0 past the end of the BM25 scores)
+        keyword = np.zeros(len(distances))
+        n = min(len(distances), len(keyword_scores))
+        keyword[:n] = keyword_scores[:n]
+        combined = semantic_weight * (1.0 / (1.0 + distances)) + keyword_weight * keyword
         
+        # Best first; stable, so equal scores keep their semantic rank
+        top = np.argsort(-combined, kind='stable')[:top_k]
+        
+        # Chunk dicts only for the results that are returned
         chunks = []
-        for i, (doc, meta, distance) in enumerate(zip(
-            semantic_results['documents'][0],
-            semantic_results['metadatas'][0],
-            semantic_results['distances'][0]
-        )):
-            # FIXED: Filter by well name AFTER retrieval (in Python)
-            if well_name:
-                well_names_str = meta.get('well_names', '')
-                if well_name.upper() not in well_names_str.upper():
-                    continue  # Skip chunks not matching target well
-            
-            semantic_score = 1 / (1 + distance)
-            keyword_score = keyword_scores[i] if i < len(keyword_scores) else 0
-            
-            combined_score = (semantic_weight * semantic_score + keyword_weight * keyword_score)
-            
+        for i in top.tolist():
+            meta = metadatas[i]
             chunks.append({
-                'content': doc,
+                'content': documents[i],
                 'metadata': meta,
-                'score': combined_score,
+                'score': float(combined[i]),
                 'citation': f"{meta.get('source_file', 'Unknown')} p.{meta.get('page_number', '?')}"
             })
         
-        chunks.sort(key=lambda x: x['score'], reverse=True)
-        return {'chunks': chunks[:top_k]}
+        return {'chunks': chunks}
+    
+    def _resolve_mode(self, mode):
+        """Retrieval settings of a query mode, read from the config once per mode"""
+        strategy_map = {'qa': 'factual_qa', 'extract': 'technical_extraction', 'summary': 'summary'}
+        strategy = strategy_map.get(mode, 'factual_qa')
+        collection_name = self.config['embedding_strategies'][strategy]['collection']
+        top_k_key = f"top_k_{mode if mode != 'qa' else 'factual'}"
+        rag_config = self.config['agents']['rag_retrieval']
+        return (collection_name, rag_config[top_k_key],
+                rag_config['hybrid_weight_semantic'], rag_config['hybrid_weight_keyword'])
+    
+    def _bm25_scores(self, bm25, collection_name, query):
+        """BM25 scores of every indexed chunk for a query, memoized for repeated queries"""
+        key = (collection_name, query)
+        scores = self._bm25_score_cache.get(key)
+        if scores is not None:
+            self._bm25_score_cache.move_to_end(key)
+            return scores
+        
+        scores = bm25.get_scores(query.lower().split())
+        self._bm25_score_cache[key] = scores
+        if len(self._bm25_score_cache) > self.bm25_cache_size:
+            self._bm25_score_cache.popitem(last=False)  # Evict least recently used query
+        return scores